@@ -0,0 +1,13 @@
+import os
+
+from project.concurrency import web_threads
+
+# Import the app once in the master so workers fork with it already loaded.
+# Nothing connects to the database at import, so no connection is shared.
+preload_app = True
+
+# Workers keep their own index page cache; it is invalidated through the
+# entries_version row in the database, so writes from any worker are seen.
+workers = int(os.getenv("WEB_CONCURRENCY", 2 * (os.cpu_count() or 1) + 1))
+worker_class = "gthread"
+threads = web_threads
@@ -1,8 +1,12 @@
+import hmac
+import json
 import os
+import sqlite3
+import threading
 from enum import Enum
 from pathlib import Path
-from functools import wraps
-from typing import Union
+from functools import lru_cache, wraps
+from typing import Iterable, Iterator, Union
 
 from flask import (
     Flask,
@@ -11,11 +15,16 @@ from flask import (
     session,
     redirect,
     flash,
-    url_for,
     jsonify,
     Response,
+    stream_with_context,
 )
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func, or_
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+from project.concurrency import web_threads
 
 basedir = Path(__file__).resolve().parent.parent
 
@@ -28,6 +37,20 @@ SQLALCHEMY_DATABASE_URI = os.getenv(
     "DATABASE_URL", f"sqlite:///{Path(basedir).joinpath(DATABASE)}"
 )
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+JSON_SORT_KEYS = False
+JSONIFY_PRETTYPRINT_REGULAR = False
+# let browsers reuse static assets for 12 hours
+SEND_FILE_MAX_AGE_DEFAULT = 43200
+# keep SQLite connections open between requests instead of the NullPool default
+SQLALCHEMY_ENGINE_OPTIONS = (
+    {
+        "poolclass": QueuePool,
+        "pool_size": web_threads,
+        "connect_args": {"check_same_thread": False},
+    }
+    if SQLALCHEMY_DATABASE_URI.startswith("sqlite")
+    else {"pool_size": web_threads}
+)
 
 # Create and initialize a new Flask app
 app = Flask(__name__)
@@ -38,19 +61,148 @@ app.config.from_object(__name__)
 # init sqlalchemy
 db = SQLAlchemy(app)
 
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """Tunes every new SQLite connection for concurrent reads and cheap commits."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    dbapi_connection.executescript(
+        "PRAGMA journal_mode=WAL;"
+        "PRAGMA synchronous=NORMAL;"
+        "PRAGMA temp_store=MEMORY;"
+        "PRAGMA cache_size=-20000;"
+        "PRAGMA busy_timeout=5000;"
+    )
+    # take the write lock when the transaction starts rather than on first write
+    dbapi_connection.isolation_level = "IMMEDIATE"
+
+
+@event.listens_for(Engine, "connect")
+def register_sqlite_functions(dbapi_connection, connection_record) -> None:
+    """Adds the SQL functions used by the views to every new SQLite connection."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    # SQLite's lower() only folds ASCII letters; search needs Python's str.lower
+    dbapi_connection.create_function(
+        "unicode_lower",
+        1,
+        lambda value: value.lower() if isinstance(value, str) else value,
+        deterministic=True,
+    )
+
+
 from project import models
 
+# serializes writers so they queue up here instead of on SQLite's busy handler
+write_lock = threading.Lock()
+
+# rendered index pages, keyed by ETag and mount prefix
+index_cache = {}
+
+
+def entries_version() -> str:
+    """Identifies the current contents of the post table."""
+    epoch, version = db.session.query(
+        models.EntriesVersion.epoch, models.EntriesVersion.version
+    ).one()
+    return f"{epoch}-{version}"
+
+
+def store_index_page(key: tuple, html: str) -> None:
+    """Caches a rendered index page, dropping old versions once the cache fills."""
+    if len(index_cache) >= 32:
+        index_cache.clear()
+    index_cache[key] = html
+
+
+def newest_entries():
+    """Queries all posts newest first, walking the rowid B-tree backwards."""
+    return db.session.query(models.Post).order_by(models.Post.id.desc())
+
+
+def generate_template(template_name: str, **context) -> Iterator[str]:
+    """Renders a template lazily, without Flask's template rendering signals."""
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    return template.generate(context)
+
+
+def cache_index_page(key: tuple, chunks: Iterable[str]) -> Iterator[str]:
+    """Passes rendered chunks through, caching the page once it is complete."""
+    page = []
+    for chunk in chunks:
+        page.append(chunk)
+        yield chunk
+    store_index_page(key, "".join(page))
+
+
+@lru_cache(maxsize=None)
+def index_path() -> str:
+    """Builds the index route's path once; prefix it with request.script_root."""
+    return app.url_map.bind("").build("index")
+
+
+def redirect_to_index() -> Response:
+    """Redirects to the index page below the prefix the app is mounted under."""
+    return redirect(request.script_root + index_path())
+
+
+@lru_cache(maxsize=8)
+def credential_bytes(value: str) -> bytes:
+    """Encodes a configured credential once per distinct value."""
+    return value.encode()
+
 
 class Status(Enum):
     Failure = 0
     Success = 1
 
 
+# delete_entry's success payload never changes, so it is serialized once,
+# in the same compact form jsonify produces
+post_deleted_json = (
+    json.dumps(
+        {"status": Status.Success.value, "message": "Post Deleted"},
+        separators=(",", ":"),
+        sort_keys=app.config["JSON_SORT_KEYS"],
+    )
+    + "\n"
+).encode()
+
+
 @app.route("/")
-def index():
+def index() -> Response:
     """Searches the database for entries, then displays them."""
-    entries = db.session.query(models.Post)
-    return render_template("index.html", entries=entries)
+    logged_in = int(bool(session.get("logged_in")))
+    etag = f"{entries_version()}-{logged_in}"
+    # flashed messages are consumed by the render, so those pages are never cached
+    cacheable = "_flashes" not in session
+    if cacheable and request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        # the page links are built below the prefix the app is mounted under
+        key = (etag, request.script_root)
+        html = index_cache.get(key)
+        if not cacheable:
+            # the session cookie is written before a streamed body is sent, so
+            # flashed messages must be consumed by a regular render
+            entries = newest_entries()
+            response = app.make_response(render_template("index.html", entries=entries))
+        elif html is not None:
+            response = app.make_response(html)
+        else:
+            # stream rows straight from the cursor into the template
+            entries = newest_entries().yield_per(100)
+            chunks = generate_template("index.html", entries=entries)
+            response = app.response_class(
+                stream_with_context(cache_index_page(key, chunks)),
+                mimetype="text/html",
+            )
+    if cacheable:
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+    return response
 
 
 @app.route("/login", methods=["GET", "POST"])
@@ -58,14 +210,18 @@ def login() -> Union[Response, str]:
     """User login/authentication/session management."""
     error = None
     if request.method == "POST":
-        if request.form["username"] != app.config["USERNAME"]:
+        username = request.form.get("username", "").encode()
+        password = request.form.get("password", "").encode()
+        if not hmac.compare_digest(username, credential_bytes(app.config["USERNAME"])):
             error = "Invalid username"
-        elif request.form["password"] != app.config["PASSWORD"]:
+        elif not hmac.compare_digest(
+            password, credential_bytes(app.config["PASSWORD"])
+        ):
             error = "Invalid password"
         else:
             session["logged_in"] = True
             flash("You were logged in")
-            return redirect(url_for("index"))
+            return redirect_to_index()
     return render_template("login.html", error=error)
 
 
@@ -74,7 +230,7 @@ def logout() -> Response:
     """User logout/authentication/session management"""
     session.pop("logged_in", None)
     flash("You were logged out")
-    return redirect(url_for("index"))
+    return redirect_to_index()
 
 
 def login_required(f):
@@ -96,30 +252,70 @@ def login_required(f):
 def add_entry() -> Response:
     """Adds a new post to the database."""
     new_entry = models.Post(request.form["title"], request.form["text"])
-    db.session.add(new_entry)
-    db.session.commit()
+    with write_lock:
+        db.session.add(new_entry)
+        db.session.commit()
     flash("New entry was successfully posted")
-    return redirect(url_for("index"))
+    return redirect_to_index()
+
+
+@app.route("/add_bulk", methods=["POST"])
+@login_required
+def add_entries() -> Union[Response, tuple]:
+    """Adds a JSON list of posts to the database in a single transaction."""
+    entries = request.get_json(silent=True)
+    if not isinstance(entries, list) or not all(
+        isinstance(entry, dict)
+        and isinstance(entry.get("title"), str)
+        and isinstance(entry.get("text"), str)
+        for entry in entries
+    ):
+        return (
+            jsonify(
+                {
+                    "status": Status.Failure.value,
+                    "message": "Expected a list of posts with a title and a text",
+                }
+            ),
+            400,
+        )
+    rows = [{"title": entry["title"], "text": entry["text"]} for entry in entries]
+    if rows:
+        with write_lock:
+            db.session.execute(models.Post.__table__.insert(), rows)
+            db.session.commit()
+    return jsonify(
+        {"status": Status.Success.value, "message": f"{len(rows)} entries added"}
+    )
 
 
-@app.route("/delete/<post_id>", methods=["GET"])
+@app.route("/delete/<int:post_id>", methods=["GET"])
 @login_required
 def delete_entry(post_id: int) -> Response:
     """Deletes a post from the database"""
     try:
-        db.session.query(models.Post).filter_by(id=post_id).delete()
-        db.session.commit()
-        result = {"status": Status.Success.value, "message": "Post Deleted"}
+        with write_lock:
+            db.session.query(models.Post).filter_by(id=post_id).delete()
+            db.session.commit()
     except Exception as e:
-        result = {"status": Status.Failure.value, "message": repr(e)}
-    return jsonify(result)
+        return jsonify({"status": Status.Failure.value, "message": repr(e)})
+    return Response(post_deleted_json, mimetype="application/json")
 
 
 @app.route("/search", methods=["GET"])
 def search() -> str:
+    """Displays the posts whose title or text contains the query."""
     query = request.args.get("query")
-    entries = db.session.query(models.Post)
     if query:
+        # Postgres' lower() already folds non-ASCII letters
+        fold = func.unicode_lower if db.engine.dialect.name == "sqlite" else func.lower
+        pattern = query.lower()
+        entries = db.session.query(models.Post).filter(
+            or_(
+                fold(models.Post.title).contains(pattern, autoescape=True),
+                fold(models.Post.text).contains(pattern, autoescape=True),
+            )
+        )
         return render_template("search.html", entries=entries, query=query)
     return render_template("search.html")
 
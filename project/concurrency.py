@@ -0,0 +1,5 @@
+import os
+
+# request-serving threads per worker process; the connection pool keeps one
+# connection for each, so threads never wait on the pool
+web_threads = int(os.getenv("WEB_THREADS", 4))
@@ -1,3 +1,7 @@
+from uuid import uuid4
+
+from sqlalchemy import event, select
+
 from project.app import db
 
 
@@ -12,3 +16,46 @@ class Post(db.Model):
 
     def __repr__(self):
         return f"<title {self.title}>"
+
+
+class EntriesVersion(db.Model):
+    """Single row counting the changes made to the post table."""
+
+    __tablename__ = "entries_version"
+    id = db.Column(db.Integer, primary_key=True)
+    # random per database, so a recreated database never repeats old versions
+    epoch = db.Column(db.String(32), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+
+
+# bump the version in the same transaction as any write to post, whoever makes it
+SQLITE_VERSION_TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS post_{operation.lower()}_version "
+    f"AFTER {operation} ON post "
+    "BEGIN UPDATE entries_version SET version = version + 1; END"
+    for operation in ("INSERT", "UPDATE", "DELETE")
+]
+POSTGRES_VERSION_TRIGGERS = [
+    "CREATE OR REPLACE FUNCTION bump_entries_version() RETURNS trigger AS $$ "
+    "BEGIN UPDATE entries_version SET version = version + 1; RETURN NULL; END; "
+    "$$ LANGUAGE plpgsql",
+    "DROP TRIGGER IF EXISTS post_version ON post",
+    "CREATE TRIGGER post_version AFTER INSERT OR UPDATE OR DELETE ON post "
+    "FOR EACH STATEMENT EXECUTE PROCEDURE bump_entries_version()",
+]
+
+
+@event.listens_for(db.metadata, "after_create")
+def create_entries_version(target, connection, **kw) -> None:
+    """Seeds the version row and installs the triggers that keep it current."""
+    table = EntriesVersion.__table__
+    if connection.execute(select([table.c.id])).first() is None:
+        connection.execute(
+            table.insert(), {"id": 1, "epoch": uuid4().hex, "version": 0}
+        )
+    if connection.dialect.name == "sqlite":
+        triggers = SQLITE_VERSION_TRIGGERS
+    else:
+        triggers = POSTGRES_VERSION_TRIGGERS
+    for trigger in triggers:
+        connection.execute(trigger)
@@ -1,23 +1,36 @@
 import json
 import pytest
 from pathlib import Path
-from project.app import app, db, Status
+from uuid import uuid4
+from project import models
+from project.app import app, db, newest_entries, write_lock, Status
 
 TEST_DB = "test.db"
 
 
-@pytest.fixture
-def client():
+@pytest.fixture(scope="session")
+def database():
     BASE_DIR = Path(__file__).resolve().parent.parent
     app.config["TESTING"] = True
     app.config["DATABASE"] = BASE_DIR.joinpath(TEST_DB)
     app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{BASE_DIR.joinpath(TEST_DB)}"
 
-    db.create_all()  # setup
-    yield app.test_client()  # tests run here
+    db.create_all()  # setup, once per test session
+    yield db
     db.drop_all()
 
 
+@pytest.fixture
+def client(database):
+    yield app.test_client()  # tests run here
+    # empty the post table rather than recreating the schema for every test;
+    # the version triggers retire the index pages rendered from those rows
+    database.session.remove()
+    with write_lock:
+        database.session.query(models.Post).delete()
+        database.session.commit()
+
+
 def login(client, username, password):
     """Login helper function"""
     return client.post(
@@ -44,9 +57,90 @@ def add_entry(client, title, text):
     )
 
 
+def add_entries(client, titles, texts):
+    return client.post(
+        "/add_bulk",
+        json=[dict(title=title, text=text) for title, text in zip(titles, texts)],
+    )
+
+
 def test_index(client):
     response = client.get("/", content_type="html/text")
     assert response.status_code == 200
+    assert "Content-Length" not in response.headers  # streamed
+    assert b"No entries yet. Add some!" in response.data
+
+    # The second request is served from the rendered page cache.
+    cached = client.get("/", content_type="html/text")
+    assert "Content-Length" in cached.headers
+    assert cached.data == response.data
+
+
+def test_index_order(client):
+    """Ensure the newest entries are listed first without a sort step"""
+    login(client, app.config["USERNAME"], app.config["PASSWORD"])
+    add_entries(client, ["title1", "title2"], ["text1", "text2"])
+    rv = client.get("/")
+    assert rv.data.index(b"title2") < rv.data.index(b"title1")
+
+    query = newest_entries().statement.compile(db.engine)
+    plan = db.session.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+    assert not any("TEMP B-TREE" in row[-1] for row in plan)
+
+
+def test_index_etag(client):
+    """Ensure unchanged index pages are answered with 304 Not Modified"""
+    rv = client.get("/")
+    etag = rv.headers["ETag"]
+    rv.close()
+    rv = client.get("/", headers={"If-None-Match": etag})
+    assert rv.status_code == 304
+
+    login(client, app.config["USERNAME"], app.config["PASSWORD"])
+    rv = client.get("/", headers={"If-None-Match": etag})
+    assert rv.status_code == 200
+    etag = rv.headers["ETag"]
+    rv.close()
+
+    add_entries(client, ["title1"], ["text1"])
+    rv = client.get("/", headers={"If-None-Match": etag})
+    assert rv.status_code == 200
+    assert b"title1" in rv.data
+
+
+def test_index_etag_external_write(client):
+    """Ensure writes made outside the views invalidate the index page"""
+    rv = client.get("/")
+    etag = rv.headers["ETag"]
+    rv.close()
+
+    db.session.execute(models.Post.__table__.insert(), dict(title="t1", text="x1"))
+    db.session.commit()
+    rv = client.get("/", headers={"If-None-Match": etag})
+    assert rv.status_code == 200
+    assert b"t1" in rv.data
+
+
+def test_index_etag_new_database(client):
+    """Ensure ETags issued for a recreated database are not answered with 304"""
+    rv = client.get("/")
+    etag = rv.headers["ETag"]
+    rv.close()
+
+    db.session.execute(
+        models.EntriesVersion.__table__.update().values(epoch=uuid4().hex)
+    )
+    db.session.commit()
+    rv = client.get("/", headers={"If-None-Match": etag})
+    assert rv.status_code == 200
+    rv.close()
+
+
+def test_static_cache(client):
+    """Ensure static assets are sent with a cache lifetime"""
+    rv = client.get("/static/main.js")
+    assert rv.cache_control.max_age == app.config["SEND_FILE_MAX_AGE_DEFAULT"]
+    rv.close()
 
 
 def test_database(client):
@@ -72,6 +166,27 @@ def test_login_logout(client):
     assert b"Invalid password" in rv.data
 
 
+def test_login_config(client, monkeypatch):
+    """Ensure login checks the credentials currently in the app config"""
+    monkeypatch.setitem(app.config, "PASSWORD", "s3cret")
+    rv = login(client, app.config["USERNAME"], "admin")
+    assert b"Invalid password" in rv.data
+    rv = login(client, app.config["USERNAME"], "s3cret")
+    assert b"You were logged in" in rv.data
+
+
+def test_redirect_under_prefix(client):
+    """Ensure redirects keep the prefix the app is mounted under"""
+    rv = client.post(
+        "/login",
+        data=dict(username=app.config["USERNAME"], password=app.config["PASSWORD"]),
+        base_url="http://localhost/flaskr/",
+    )
+    assert rv.headers["Location"].endswith("/flaskr/")
+    rv = client.get("/logout", base_url="http://localhost/flaskr/")
+    assert rv.headers["Location"].endswith("/flaskr/")
+
+
 def test_messages(client):
     """Ensure that user can post messages"""
     login(client, app.config["USERNAME"], app.config["PASSWORD"])
@@ -81,6 +196,29 @@ def test_messages(client):
     assert b"<strong>HTML</strong> allowed here" in rv.data
 
 
+def test_bulk_add(client):
+    """Ensure that a logged in user can post several messages at once"""
+    rv = add_entries(client, ["title1"], ["text1"])
+    assert rv.status_code == 401
+
+    login(client, app.config["USERNAME"], app.config["PASSWORD"])
+    rv = add_entries(client, ["title1", "title2"], ["text1", "text2"])
+    data = json.loads(rv.data)
+    assert data["status"] == Status.Success.value
+    rv = client.get("/")
+    assert b"title1" in rv.data and b"title2" in rv.data
+
+    rv = client.post("/add_bulk", json={"title": "title3"})
+    assert rv.status_code == 400
+
+    # Titles and texts must be strings.
+    for title in [None, 5, {"a": 1}]:
+        rv = client.post("/add_bulk", json=[dict(title=title, text="text3")])
+        assert rv.status_code == 400
+    rv = client.post("/add_bulk", json=[dict(title="title3", text=None)])
+    assert rv.status_code == 400
+
+
 def test_delete_message(client):
     """Ensure the messages are being deleted"""
     # Delete fails before login.
@@ -93,6 +231,12 @@ def test_delete_message(client):
     rv = client.get("/delete/1")
     data = json.loads(rv.data)
     assert data["status"] == Status.Success.value
+    assert rv.mimetype == "application/json"
+    assert rv.data.endswith(b"}\n") and b", " not in rv.data
+
+    # Non-numeric ids are rejected by the router.
+    rv = client.get("/delete/1 or 1=1")
+    assert rv.status_code == 404
 
 
 def test_search(client):
@@ -103,8 +247,7 @@ def test_search(client):
     test_texts = ["text1", "text2", "text3"]
 
     # Init the db with some entries
-    for title, text in zip(test_titles, test_texts):
-        add_entry(client, title, text)
+    add_entries(client, test_titles, test_texts)
 
     def assert_successful_search(html_content, allowed_titles=None, allowed_texts=None):
         allowed_texts = allowed_texts or []
@@ -157,3 +300,37 @@ def test_search(client):
         allowed_titles=test_titles[-1:],
         allowed_texts=test_texts[-1:],
     )
+
+    # Test case-insensitive match
+    assert_successful_search(
+        search(client, query="TITLE2").data,
+        allowed_titles=test_titles[1:2],
+        allowed_texts=test_texts[1:2],
+    )
+
+    # Test that LIKE wildcards are matched literally
+    assert_successful_search(
+        search(client, query="%").data, allowed_titles=[], allowed_texts=[]
+    )
+
+
+def test_search_unicode(client):
+    """Ensure that search ignores the case of non-ASCII letters"""
+    login(client, app.config["USERNAME"], app.config["PASSWORD"])
+    add_entries(client, ["Élan"], ["Ärger"])
+
+    assert "Élan".encode() in search(client, query="é").data
+    assert "Élan".encode() in search(client, query="äRGER").data
+
+
+def test_sqlite_pragmas(client):
+    """Ensure new connections are switched to WAL with relaxed syncing"""
+    assert db.session.execute("PRAGMA journal_mode").scalar() == "wal"
+    assert db.session.execute("PRAGMA synchronous").scalar() == 1
+    assert db.session.execute("PRAGMA busy_timeout").scalar() == 5000
+
+
+def test_connection_pool(client):
+    """Ensure SQLite connections are pooled across requests"""
+    client.get("/").close()
+    assert db.engine.pool.checkedin() >= 1